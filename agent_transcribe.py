@@ -11,27 +11,31 @@ Features:
 - nyelvi beállítás: --lang hu (promptok és policy jellegű küszöbök irányába)
 
 Prereq:
-- pdftoppm (poppler)
+- pdftoppm (poppler) — vagy --rasterizer pdfium esetén pypdfium2
 - (éles mód) openai SDK + OPENAI_API_KEY
+- (opcionális) h2 a HTTP/2 multiplexinghez, orjson, numpy (--auto-thresholds)
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
 import dataclasses
+import functools
 import hashlib
+import io
 import json
 import os
-import re
-import shutil
 import subprocess
+import threading
 import time
 import base64
-import signal
-import multiprocessing as mp
-from dataclasses import dataclass, asdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from _json_shim import dumps as json_dumps, dumps_line as json_dumps_line
 
 
 # ----------------------------
@@ -40,9 +44,20 @@ from typing import Any, Dict, List, Optional, Tuple
 
 DEFAULT_DPI = 300
 
-# Bizonytalanság-jelölők
-UNCERTAIN_RE = re.compile(r"\[\?\]")
-ILLEGIBLE_RE = re.compile(r"\[\…\]|\[\.\.\.\]")  # […], [...]
+# Bizonytalanság-jelölők — literál tokenek, nincs igazi regex szemantika
+UNCERTAIN_MARKER = "[?]"
+ILLEGIBLE_MARKERS = ("[…]", "[...]")
+
+# Modell-kimeneti blokk fejlécek + előre számolt hosszak (a find+slice
+# parserek minden modellválaszra lefutnak)
+HDR_TX = "=== TRANSCRIPTION ==="
+_LEN_TX = len(HDR_TX)
+HDR_META = "=== META ==="
+_LEN_META = len(HDR_META)
+HDR_CORR = "=== CORRECTED_TEXT ==="
+_LEN_CORR = len(HDR_CORR)
+HDR_EDIT = "=== EDIT_LOG ==="
+_LEN_EDIT = len(HDR_EDIT)
 
 # Küszöbök — HU-hoz kicsit engedékenyebbek lehetnek (toldalékolás, hosszú szavak)
 DEFAULT_THRESHOLDS = {
@@ -65,6 +80,7 @@ class PageState:
     confidence: Optional[str] = None  # low | medium | high
     uncertain_count: int = 0
     illegible_count: int = 0
+    char_count: int = 0
     retries_used: int = 0
     notes: str = ""
 
@@ -85,6 +101,9 @@ class AgentState:
     created_utc: str = ""
     updated_utc: str = ""
 
+    # nem szerializált dirty flag (nincs annotáció -> nem dataclass field)
+    _dirty = False
+
 
 def utc_now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
@@ -99,23 +118,35 @@ def load_state(state_path: Path) -> Optional[AgentState]:
     return AgentState(**data)
 
 
+def _state_payload(state: AgentState) -> Dict[str, Any]:
+    # kézi, sekély dict: az asdict() minden mentésnél rekurzívan deep-copyzná
+    # az összes PageState-et (N dict allokáció / mentés)
+    payload = {f.name: getattr(state, f.name) for f in dataclasses.fields(AgentState)}
+    payload["pages"] = [vars(p) for p in state.pages]
+    return payload
+
+
 def save_state(state: AgentState, state_path: Path) -> None:
     state.updated_utc = utc_now_iso()
-    payload = asdict(state)
+    payload = _state_payload(state)
     state_path.parent.mkdir(parents=True, exist_ok=True)
-    state_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+    # tmp + os.replace: atomi csere, félbevágott state fájl nem maradhat
+    tmp_path = state_path.with_suffix(".tmp")
+    tmp_path.write_bytes(json_dumps(payload))
+    os.replace(tmp_path, state_path)
+    state._dirty = False
+
+
+def maybe_flush(state: AgentState, state_path: Path) -> None:
+    """Csak akkor ír, ha van mentetlen változás — oldalhatáronként hívjuk."""
+    if state._dirty:
+        save_state(state, state_path)
 
 
 # ----------------------------
 # Helpers
 # ----------------------------
 
-def _process_timeout_worker(q, fn, args, kwargs):
-    try:
-        q.put(("ok", fn(*args, **kwargs)))
-    except Exception as e:
-        q.put(("err", (type(e).__name__, str(e))))
-        
 def run(cmd: List[str]) -> None:
     p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     if p.returncode != 0:
@@ -129,9 +160,16 @@ def ensure_dir(p: Path) -> None:
 
 
 def sha256_short(path: Path, max_bytes: int = 1024 * 1024) -> str:
+    # 64 KiB-os darabokban streamelünk, nem egyetlen max_bytes-os olvasással
     h = hashlib.sha256()
+    remaining = max_bytes
     with path.open("rb") as f:
-        h.update(f.read(max_bytes))
+        while remaining > 0:
+            buf = f.read(min(65536, remaining))
+            if not buf:
+                break
+            h.update(buf)
+            remaining -= len(buf)
     return h.hexdigest()[:8]
 
 
@@ -141,7 +179,10 @@ def compute_source_id(pdf_path: Path) -> str:
 
 
 def count_markers(text: str) -> Tuple[int, int]:
-    return len(UNCERTAIN_RE.findall(text)), len(ILLEGIBLE_RE.findall(text))
+    # str.count C-szintű keresés, nem allokál match-listát mint a re.findall
+    uncertain = text.count(UNCERTAIN_MARKER)
+    illegible = sum(text.count(m) for m in ILLEGIBLE_MARKERS)
+    return uncertain, illegible
 
 
 def prompt_yes_no(msg: str) -> bool:
@@ -153,109 +194,253 @@ def prompt_yes_no(msg: str) -> bool:
             return False
 
 
+@functools.lru_cache(maxsize=None)
 def load_prompt_file(path: Path) -> str:
+    # memoizált: directory módban PDF-enként nem olvassuk újra
     if not path.exists():
         raise FileNotFoundError(f"Missing prompt file: {path}")
     return path.read_text(encoding="utf-8")
 
-class HardTimeout(Exception):
-    pass
+# ----------------------------
+# PDF -> PNG
+# ----------------------------
 
-def _alarm_handler(signum, frame):
-    raise HardTimeout("Hard timeout reached")
+def pdf_page_count(pdf_path: Path) -> int:
+    p = subprocess.run(["pdfinfo", str(pdf_path)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"pdfinfo failed for {pdf_path}\nSTDERR:\n{p.stderr}")
+    for line in p.stdout.splitlines():
+        if line.startswith("Pages:"):
+            return int(line.split()[1])
+    raise RuntimeError(f"Could not determine page count for {pdf_path}")
 
-def call_with_hard_timeout(seconds: int, fn, *args, **kwargs):
-    """
-    macOS/Linux: SIGALRM működik (main thread).
-    Biztosíték arra, hogy egy oldal ne tudjon végtelenül lógni.
-    """
-    old = signal.signal(signal.SIGALRM, _alarm_handler)
-    signal.alarm(seconds)
+
+def _format_args(image_format: str) -> Tuple[List[str], str]:
+    """pdftoppm kimeneti formátum kapcsolói + fájlkiterjesztés."""
+    if image_format == "jpeg":
+        # JPEG q90: ~10x kisebb upload mint a 300dpi PNG, kézirathoz elég
+        return ["-jpeg", "-jpegopt", "quality=90"], "jpg"
+    return ["-png"], "png"
+
+
+def pdf_to_png(pdf_path: Path, images_dir: Path, source_id: str, dpi: int, image_format: str = "png") -> List[Path]:
+    ensure_dir(images_dir)
+    prefix = images_dir / f"{source_id}_p"
+    fmt_args, ext = _format_args(image_format)
+
+    # pdftoppm single-threaded -> page-range shardok, egy process / shard.
+    # A subprocess hívás elengedi a GIL-t, így ThreadPoolExecutor elég.
+    # (Sok shardnál az ulimit -n lehet korlát: shardonként nyitott fájlok.)
+    n_pages = pdf_page_count(pdf_path)
+    workers = min(os.cpu_count() or 1, n_pages)
+    step = -(-n_pages // workers)  # ceil div
+    ranges = [(first, min(first + step - 1, n_pages)) for first in range(1, n_pages + 1, step)]
+
+    def render_range(first: int, last: int) -> None:
+        run(["pdftoppm", *fmt_args, "-r", str(dpi), "-f", str(first), "-l", str(last), str(pdf_path), str(prefix)])
+
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(render_range, first, last) for first, last in ranges]
+        for fut in as_completed(futures):
+            fut.result()
+
+    # pdftoppm kimenet: prefix-<num>.<ext>; a várt neveket közvetlenül
+    # képezzük és csak az eltérőket nevezzük át (os.rename, nincs glob+stat)
+    return [_rename_rendered_page(images_dir, source_id, i, ext) for i in range(1, n_pages + 1)]
+
+
+def _require_pdfium():
+    try:
+        import pypdfium2 as pdfium
+    except Exception as e:
+        raise RuntimeError("pypdfium2 not installed. Run: pip install pypdfium2") from e
+    return pdfium
+
+
+# A PDFium nem szálbiztos (külön dokumentumok között sem) — minden PDFium
+# hívás e lock alatt fut, párhuzamosan csak a PIL encode megy
+_pdfium_lock = threading.Lock()
+
+
+def pdf_page_count_pdfium(pdf_path: Path) -> int:
+    pdfium = _require_pdfium()
+    pdf = pdfium.PdfDocument(str(pdf_path))
     try:
-        return fn(*args, **kwargs)
+        return len(pdf)
     finally:
-        signal.alarm(0)
-        signal.signal(signal.SIGALRM, old)
-        
-def call_with_process_timeout(seconds: int, fn, *args, **kwargs):
+        pdf.close()
+
+
+def _pdfium_page_renderer(pdf_path: Path, images_dir: Path, source_id: str, dpi: int, image_format: str = "png"):
     """
-    Biztos timeout: külön processben futtatja az fn-t.
-    Ha seconds lejár, terminate.
-    Visszaadja az fn eredményét vagy TimeoutError-t dob.
+    Oldal-renderelő closure PDFiumhoz. A PDFium hívások a _pdfium_lock alatt
+    sorosodnak (a pypdfium2 dokumentáltan nem szálbiztos, dokumentumok között
+    sem); a PIL encode + fájlírás viszont lockon kívül, párhuzamosan fut.
     """
-    q: mp.Queue = mp.Queue()
-    p = mp.Process(target=_process_timeout_worker, args=(q, fn, args, kwargs))
-    p.start()
-    p.join(seconds)
-
-    if p.is_alive():
-        p.terminate()
-        p.join(5)
-        raise TimeoutError(f"Process timeout after {seconds}s")
-
-    if q.empty():
-        raise RuntimeError("Worker exited without returning result")
-
-    status, payload = q.get()
-    if status == "ok":
-        return payload
-    name, msg = payload
-    raise RuntimeError(f"Worker error {name}: {msg}")
-        
-# ----------------------------
-# PDF -> PNG
-# ----------------------------
+    pdfium = _require_pdfium()
+    _, ext = _format_args(image_format)
+    with _pdfium_lock:
+        doc = pdfium.PdfDocument(str(pdf_path))
+
+    def render(page_num: int) -> int:
+        out = images_dir / f"{source_id}_p{page_num:03d}.{ext}"
+        with _pdfium_lock:
+            bitmap = doc[page_num - 1].render(scale=dpi / 72)
+            pil_image = bitmap.to_pil()
+        if ext == "jpg":
+            pil_image.convert("RGB").save(out, quality=90, optimize=True, progressive=True)
+        else:
+            pil_image.save(out, optimize=False)
+        return page_num
 
-def pdf_to_png(pdf_path: Path, images_dir: Path, source_id: str, dpi: int) -> List[Path]:
-    ensure_dir(images_dir)
-    prefix = images_dir / f"{source_id}_p"
-    run(["pdftoppm", "-png", "-r", str(dpi), str(pdf_path), str(prefix)])
+    return render
 
-    # pdftoppm általában: prefix-1.png, prefix-2.png...
-    generated = sorted(images_dir.glob(f"{source_id}_p-*.png"))
-    if not generated:
-        generated = sorted(images_dir.glob("*.png"))
 
-    renamed: List[Path] = []
-    for i, path in enumerate(sorted(generated), start=1):
-        new_name = f"{source_id}_p{i:03d}.png"
-        new_path = images_dir / new_name
-        if path.name != new_name:
-            shutil.move(str(path), str(new_path))
-        renamed.append(new_path)
+def pdf_to_png_pdfium(pdf_path: Path, images_dir: Path, source_id: str, dpi: int, image_format: str = "png") -> List[Path]:
+    """In-process renderelés: nincs oldalankénti fork+exec + PDF újraparszolás."""
+    ensure_dir(images_dir)
+    n_pages = pdf_page_count_pdfium(pdf_path)
+    render = _pdfium_page_renderer(pdf_path, images_dir, source_id, dpi, image_format)
+    _, ext = _format_args(image_format)
+    with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, n_pages)) as ex:
+        pages = list(ex.map(render, range(1, n_pages + 1)))
+    return [images_dir / f"{source_id}_p{i:03d}.{ext}" for i in sorted(pages)]
+
+
+async def render_pages_pdfium_async(
+    pdf_path: Path, images_dir: Path, source_id: str, dpi: int, pages: List[int], image_format: str = "png"
+) -> AsyncIterator[int]:
+    """pdfium megfelelője a render_pages_async-nak: oldalanként yieldel."""
+    ensure_dir(images_dir)
+    render = _pdfium_page_renderer(pdf_path, images_dir, source_id, dpi, image_format)
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=min(os.cpu_count() or 1, len(pages))) as ex:
+        futures = [loop.run_in_executor(ex, render, p) for p in sorted(pages)]
+        for fut in asyncio.as_completed(futures):
+            yield await fut
+
+
+def _rename_rendered_page(images_dir: Path, source_id: str, page_num: int, ext: str = "png") -> Path:
+    """pdftoppm kimenet (prefix-<num>.<ext>, változó padding) -> kanonikus név."""
+    new_path = images_dir / f"{source_id}_p{page_num:03d}.{ext}"
+    if new_path.exists():
+        return new_path
+    for width in range(1, 7):
+        cand = images_dir / f"{source_id}_p-{page_num:0{width}d}.{ext}"
+        if cand.exists():
+            os.rename(cand, new_path)
+            return new_path
+    raise RuntimeError(f"Rendered page image not found for page {page_num} ({source_id})")
+
+
+async def render_pages_async(
+    pdf_path: Path, images_dir: Path, source_id: str, dpi: int, pages: List[int], image_format: str = "png"
+) -> AsyncIterator[int]:
+    """
+    Page-range shardok nem blokkoló subprocess-szel; a kész oldalszámokat
+    érkezési sorrendben yieldeli. Így a renderelés (poppler CPU) átfedésben
+    futhat a transzkripcióval (hálózati I/O) — wall time ~ max(R, T).
+    """
+    ensure_dir(images_dir)
+    prefix = images_dir / f"{source_id}_p"
+    fmt_args, ext = _format_args(image_format)
+    pages = sorted(pages)
+    workers = min(os.cpu_count() or 1, len(pages))
+
+    # folytonos futamok, legfeljebb ~len/workers hosszú shardokra vágva
+    step = max(1, -(-len(pages) // workers))
+    shards: List[Tuple[int, int]] = []
+    run_start = prev = pages[0]
+    count = 1
+    for p in pages[1:]:
+        if p == prev + 1 and count < step:
+            prev = p
+            count += 1
+        else:
+            shards.append((run_start, prev))
+            run_start = prev = p
+            count = 1
+    shards.append((run_start, prev))
+
+    sem = asyncio.Semaphore(workers)
+
+    async def render_shard(first: int, last: int) -> Tuple[int, int]:
+        async with sem:
+            proc = await asyncio.create_subprocess_exec(
+                "pdftoppm", *fmt_args, "-r", str(dpi), "-f", str(first), "-l", str(last),
+                str(pdf_path), str(prefix),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            )
+            _, err = await proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError(f"pdftoppm failed for pages {first}-{last}:\n{err.decode()}")
+        return first, last
 
-    return renamed
+    tasks = [asyncio.ensure_future(render_shard(first, last)) for first, last in shards]
+    for fut in asyncio.as_completed(tasks):
+        first, last = await fut
+        for page_num in range(first, last + 1):
+            _rename_rendered_page(images_dir, source_id, page_num, ext)
+            yield page_num
 
 
 # ----------------------------
 # Stub management
 # ----------------------------
 
-def stub_paths(stubs_root: Path, kind: str, page_id: str) -> Tuple[Path, Path]:
+def image_fingerprint(path: Path) -> str:
+    """Content-addressed kulcs: a kép bájtjainak SHA-256 prefixe."""
+    return hashlib.sha256(path.read_bytes()).hexdigest()[:16]
+
+
+def stub_paths(stubs_root: Path, kind: str, page_id: str, fingerprint: Optional[str] = None) -> Tuple[Path, Path]:
     """
     kind: 'diplomatic' or 'normalization'
-    diplomatic:
+    fingerprint nélkül (legacy, page_id kulcs):
       <page_id>.out.txt
       <page_id>.meta.json
+    fingerprinttel (content-addressed, bármely page_id-re újrahasznosítható):
+      by-hash/<fp>.out.txt
+      by-hash/<fp>.meta.json
     """
     base = stubs_root / kind
+    if fingerprint is not None:
+        base = base / "by-hash"
     ensure_dir(base)
-    out_txt = base / f"{page_id}.out.txt"
-    out_meta = base / f"{page_id}.meta.json"
+    key = fingerprint if fingerprint is not None else page_id
+    out_txt = base / f"{key}.out.txt"
+    out_meta = base / f"{key}.meta.json"
     return out_txt, out_meta
 
 
-def load_stub_diplomatic(stubs_root: Path, page_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+def load_stub_diplomatic(stubs_root: Path, page_id: str, fingerprint: Optional[str] = None) -> Optional[Tuple[str, Dict[str, Any]]]:
+    # 1) content-addressed találat: átnevezett/újrarendezett PDF-nél is él
+    if fingerprint is not None:
+        out_txt, out_meta = stub_paths(stubs_root, "diplomatic", page_id, fingerprint)
+        if out_txt.exists() and out_meta.exists():
+            return out_txt.read_text(encoding="utf-8"), json.loads(out_meta.read_text(encoding="utf-8"))
+    # 2) legacy page_id kulcsú stub
     out_txt, out_meta = stub_paths(stubs_root, "diplomatic", page_id)
     if out_txt.exists() and out_meta.exists():
         return out_txt.read_text(encoding="utf-8"), json.loads(out_meta.read_text(encoding="utf-8"))
+    # 3) page_id -> fingerprint alias
+    alias = stubs_root / "diplomatic" / f"{page_id}.alias"
+    if alias.exists():
+        fp = alias.read_text(encoding="utf-8").strip()
+        out_txt, out_meta = stub_paths(stubs_root, "diplomatic", page_id, fp)
+        if out_txt.exists() and out_meta.exists():
+            return out_txt.read_text(encoding="utf-8"), json.loads(out_meta.read_text(encoding="utf-8"))
     return None
 
 
-def save_stub_diplomatic(stubs_root: Path, page_id: str, transcription: str, meta: Dict[str, Any]) -> None:
-    out_txt, out_meta = stub_paths(stubs_root, "diplomatic", page_id)
+def save_stub_diplomatic(stubs_root: Path, page_id: str, transcription: str, meta: Dict[str, Any], fingerprint: Optional[str] = None) -> None:
+    out_txt, out_meta = stub_paths(stubs_root, "diplomatic", page_id, fingerprint)
     out_txt.write_text(transcription, encoding="utf-8")
-    out_meta.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
+    out_meta.write_bytes(json_dumps(meta))
+    if fingerprint is not None:
+        # alias, hogy page_id alapú replay is megtalálja a hash alatti stubot
+        alias = stubs_root / "diplomatic" / f"{page_id}.alias"
+        alias.write_text(fingerprint, encoding="utf-8")
 
 
 def make_generated_stub(source_id: str, page_num: int, page_id: str) -> Tuple[str, Dict[str, Any]]:
@@ -280,6 +465,31 @@ def make_generated_stub(source_id: str, page_num: int, page_id: str) -> Tuple[st
 # Model calls (Responses API)
 # ----------------------------
 
+@functools.lru_cache(maxsize=1)
+def _client():
+    """
+    Egy közös AsyncOpenAI kliens a teljes futásra: a httpx connection pool
+    és a TLS session oldalanként újrahasznosul, nem épül fel minden híváskor.
+    A pool a page+doc concurrency-hez van méretezve (a httpx default 10
+    kapcsolata transport szinten sorosítana), HTTP/2-vel egy TCP/TLS
+    kapcsolat multiplexálja az összes oldalt.
+    """
+    try:
+        import httpx
+        from openai import AsyncOpenAI
+    except Exception as e:
+        raise RuntimeError("OpenAI SDK not installed. Run: pip install openai") from e
+
+    limits = httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=60.0)
+    timeout = httpx.Timeout(600.0, connect=10.0)
+    try:
+        http_client = httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+    except ImportError:
+        # h2 csomag nélkül HTTP/1.1 marad (pip install h2)
+        http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+    return AsyncOpenAI(http_client=http_client, max_retries=0)
+
+
 def parse_dual_block_output(raw: str) -> Tuple[str, Dict[str, Any]]:
     """
     Expects:
@@ -288,29 +498,29 @@ def parse_dual_block_output(raw: str) -> Tuple[str, Dict[str, Any]]:
     === META ===
     {json}
     """
-    if "=== TRANSCRIPTION ===" not in raw or "=== META ===" not in raw:
+    # find + slice: blokkonként egy keresés, nincs split-közbeni allokáció
+    i = raw.find(HDR_TX)
+    j = raw.find(HDR_META, i + 1)
+    if i < 0 or j < 0:
         raise ValueError("Model output missing required block headers.")
-    a = raw.split("=== TRANSCRIPTION ===", 1)[1]
-    transcription_part, meta_part = a.split("=== META ===", 1)
-    transcription = transcription_part.strip("\n")
-    meta_text = meta_part.strip()
-    meta = json.loads(meta_text)
+    transcription = raw[i + _LEN_TX:j].strip("\n")
+    meta = json.loads(raw[j + _LEN_META:].strip())
     return transcription, meta
 
 
 def parse_three_block_output(raw: str) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
-    if "=== CORRECTED_TEXT ===" not in raw or "=== EDIT_LOG ===" not in raw or "=== META ===" not in raw:
+    i = raw.find(HDR_CORR)
+    j = raw.find(HDR_EDIT, i + 1)
+    k = raw.find(HDR_META, j + 1)
+    if i < 0 or j < 0 or k < 0:
         raise ValueError("Normalization output missing required block headers.")
-    a = raw.split("=== CORRECTED_TEXT ===", 1)[1]
-    corrected_part, rest = a.split("=== EDIT_LOG ===", 1)
-    editlog_part, meta_part = rest.split("=== META ===", 1)
-    corrected = corrected_part.strip("\n")
-    editlog = json.loads(editlog_part.strip())
-    meta = json.loads(meta_part.strip())
+    corrected = raw[i + _LEN_CORR:j].strip("\n")
+    editlog = json.loads(raw[j + _LEN_EDIT:k].strip())
+    meta = json.loads(raw[k + _LEN_META:].strip())
     return corrected, editlog, meta
 
 
-def transcribe_page_openai(
+async def transcribe_page_openai(
     prompt_rules: str,
     image_path: Path,
     source_id: str,
@@ -319,11 +529,11 @@ def transcribe_page_openai(
     page_id: str,
 ) -> Tuple[str, Dict[str, Any]]:
     try:
-        from openai import OpenAI, APITimeoutError, APIConnectionError, RateLimitError, APIError
+        from openai import APITimeoutError, APIConnectionError, RateLimitError, APIError
     except Exception as e:
         raise RuntimeError("OpenAI SDK not installed. Run: pip install openai") from e
 
-    client = OpenAI(timeout=600, max_retries=0)
+    client = _client()
     model_id = os.environ.get("TRANSCRIBE_MODEL", "gpt-4.1")
 
     user_prompt = f"""Language: {lang}
@@ -335,13 +545,16 @@ Task: Produce a diplomatic transcription of this page image.
 Do not translate. Use the required output block headers and JSON schema.
 """
 
-    img_b64 = base64.b64encode(image_path.read_bytes()).decode("utf-8")
-    data_url = f"data:image/png;base64,{img_b64}"
+    # bytes-ban fűzünk, és egyetlen ASCII decode a végén (memcpy fast path,
+    # nem kell UTF-8 validátor) — egy teljes kép-méretű másolattal kevesebb
+    media_type = "image/jpeg" if image_path.suffix in (".jpg", ".jpeg") else "image/png"
+    raw = image_path.read_bytes()
+    data_url = (f"data:{media_type};base64,".encode("ascii") + base64.b64encode(raw)).decode("ascii")
 
     last_err = None
     for attempt in range(1, 5):
         try:
-            resp = client.responses.create(
+            resp = await client.responses.create(
                 model=model_id,
                 temperature=0.0,
                 input=[
@@ -362,18 +575,13 @@ Do not translate. Use the required output block headers and JSON schema.
             last_err = e
             if attempt == 4:
                 raise
-            time.sleep(5 * (2 ** (attempt - 1)))
+            await asyncio.sleep(5 * (2 ** (attempt - 1)))
 
     raise last_err
 
 
-def normalize_v2_openai(prompt_rules: str, v1_text: str, source_id: str, lang: str) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
-    try:
-        from openai import OpenAI
-    except Exception as e:
-        raise RuntimeError("OpenAI SDK not installed. Run: pip install openai") from e
-
-    client = OpenAI()
+async def normalize_v2_openai(prompt_rules: str, v1_text: str, source_id: str, lang: str) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    client = _client()
     model_id = os.environ.get("NORMALIZE_MODEL", "gpt-4.1")
 
     user_prompt = f"""Language: {lang}
@@ -388,7 +596,7 @@ INPUT (v1):
 {v1_text}
 """
 
-    resp = client.responses.create(
+    resp = await client.responses.create(
         model=model_id,
         temperature=0.1,
         input=[
@@ -424,28 +632,107 @@ def needs_human_review(confidence: Optional[str], uncertain: int, illegible: int
     return False
 
 
+def apply_auto_thresholds(state: AgentState, log) -> None:
+    """
+    Adatvezérelt flag-elés a fix max_uncertain/max_illegible darabszámok
+    helyett: oldalankénti jelölő-sűrűség, dokumentumon belüli robosztus
+    outlier-küszöb (medián + 3*MAD). Nulla extra LLM hívás; a zajos
+    dokumentumokon csökkenti a téves review-flageket.
+    """
+    try:
+        import numpy as np
+    except Exception:
+        log("numpy not installed; --auto-thresholds ignored")
+        return
+
+    pages = [ps for ps in state.pages if ps.char_count > 0 and ps.status in ("done", "needs_review")]
+    if len(pages) < 3:
+        return  # túl kevés oldal robosztus statisztikához
+
+    uncertain = np.fromiter(
+        (ps.uncertain_count / ps.char_count for ps in pages), dtype=np.float32, count=len(pages)
+    )
+    illegible = np.fromiter(
+        (ps.illegible_count / ps.char_count for ps in pages), dtype=np.float32, count=len(pages)
+    )
+
+    def cutoff(x: "np.ndarray") -> float:
+        med = np.median(x)
+        mad = np.median(np.abs(x - med))
+        return float(med + 3.0 * mad)
+
+    outlier = (uncertain > cutoff(uncertain)) | (illegible > cutoff(illegible))
+
+    changed = 0
+    for ps, flagged in zip(pages, outlier):
+        if ps.confidence == "low":
+            continue  # alacsony konfidencia mindig review marad
+        if flagged and ps.status == "done":
+            ps.status = "needs_review"
+            ps.notes = f"Flagged by auto-threshold (u={ps.uncertain_count}, i={ps.illegible_count}, n={ps.char_count})"
+            changed += 1
+        elif not flagged and ps.status == "needs_review":
+            ps.status = "done"
+            ps.notes = "Accepted by auto-threshold (within document norm)"
+            changed += 1
+    if changed:
+        log(f"Auto-thresholds: {changed} page(s) re-flagged by marker density.")
+
+
 # ----------------------------
 # Assemble v1
 # ----------------------------
 
-def assemble_v1(state: AgentState, out_path: Path) -> None:
-    parts: List[str] = []
-    parts.append(f"=== SOURCE: {state.source_id} ===\n")
-    for ps in sorted(state.pages, key=lambda p: p.page):
-        parts.append(f"\n=== PAGE {ps.page} ===\n")
-        if not ps.diplomatic_txt_path:
-            parts.append("[MISSING PAGE TRANSCRIPTION]\n")
-        else:
-            parts.append(Path(ps.diplomatic_txt_path).read_text(encoding="utf-8").rstrip() + "\n")
+def read_pages_manifest(manifest_path: Path) -> Dict[int, str]:
+    """pages.jsonl -> {page: text}; oldalanként az utolsó rekord nyer (retry)."""
+    texts: Dict[int, str] = {}
+    if not manifest_path.exists():
+        return texts
+    with manifest_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            rec = json.loads(line)
+            texts[rec["page"]] = rec["text"]
+    return texts
+
+
+def assemble_v1(state: AgentState, out_path: Path, manifest_path: Path) -> str:
+    # közvetlenül a fájlba streamelünk: nincs parts-lista + join (2x méretű
+    # csúcs-RAM nagy dokumentumnál); a fejléc megy elsőnek, lstrip se kell.
+    # A szöveget egy StringIO-ban is megtartjuk és visszaadjuk, hogy a
+    # normalizálásnak ne kelljen az épp kiírt fájlt visszaolvasnia.
+    texts = read_pages_manifest(manifest_path)
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text("".join(parts).lstrip(), encoding="utf-8")
+    buf = io.StringIO()
+    with out_path.open("w", encoding="utf-8") as f:
+
+        def w(s: str) -> None:
+            f.write(s)
+            buf.write(s)
+
+        w(f"=== SOURCE: {state.source_id} ===\n")
+        for ps in sorted(state.pages, key=lambda p: p.page):
+            w(f"\n=== PAGE {ps.page} ===\n")
+            text = texts.get(ps.page)
+            if text is None and ps.diplomatic_txt_path and "#" not in ps.diplomatic_txt_path:
+                # legacy per-page .txt artifact (manifest előtti state-ek)
+                legacy = Path(ps.diplomatic_txt_path)
+                if legacy.exists():
+                    text = legacy.read_text(encoding="utf-8")
+            if text is None:
+                w("[MISSING PAGE TRANSCRIPTION]\n")
+            else:
+                w(text.rstrip() + "\n")
+    return buf.getvalue()
 
 
 # ----------------------------
 # Core: run agent for ONE PDF
 # ----------------------------
 
-def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bool, hitl: bool, stub_mode: str) -> None:
+async def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bool, hitl: bool, stub_mode: str, concurrency: int = 8, rasterizer: str = "pdftoppm", image_format: str = "png", auto_thresholds: bool = False) -> None:
     source_id = compute_source_id(pdf_path)
 
     # paths
@@ -488,6 +775,7 @@ def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bo
     work_dir = project_root / "work" / source_id
     images_dir = work_dir / "images"
     diplomatic_dir = work_dir / "diplomatic"
+    manifest_path = diplomatic_dir / "pages.jsonl"
     ensure_dir(images_dir)
     ensure_dir(diplomatic_dir)
 
@@ -498,13 +786,32 @@ def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bo
 
     # Stage: init -> images_ready
     if state.stage == "init":
-        log("Stage: PDF -> PNG")
-        imgs = pdf_to_png(pdf_path, images_dir, source_id, state.dpi)
-        state.pages = [PageState(page=i, image_path=str(p)) for i, p in enumerate(imgs, start=1)]
-        state.pages_total = len(state.pages)
+        if hitl:
+            # soros HITL út: minden kép előre, mint eddig
+            log("Stage: PDF -> PNG")
+            if rasterizer == "pdfium":
+                imgs = pdf_to_png_pdfium(pdf_path, images_dir, source_id, state.dpi, image_format)
+            else:
+                imgs = pdf_to_png(pdf_path, images_dir, source_id, state.dpi, image_format)
+            state.pages = [PageState(page=i, image_path=str(p)) for i, p in enumerate(imgs, start=1)]
+            state.pages_total = len(state.pages)
+        else:
+            # pipelined út: csak az oldalakat soroljuk fel, a renderelés a
+            # transzkripcióval átfedésben fut (lásd run_concurrent producer)
+            log("Stage: PDF -> PNG (pipelined with transcription)")
+            if rasterizer == "pdfium":
+                n_pages = pdf_page_count_pdfium(pdf_path)
+            else:
+                n_pages = pdf_page_count(pdf_path)
+            _, ext = _format_args(image_format)
+            state.pages = [
+                PageState(page=i, image_path=str(images_dir / f"{source_id}_p{i:03d}.{ext}"))
+                for i in range(1, n_pages + 1)
+            ]
+            state.pages_total = n_pages
         state.stage = "images_ready"
         save_state(state, state_path)
-        log(f"Images exported: {state.pages_total} pages")
+        log(f"Pages scheduled: {state.pages_total}")
 
     # Stage: images_ready -> transcribing
     if state.stage == "images_ready":
@@ -514,29 +821,15 @@ def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bo
 
     # Stage: transcribing
     if state.stage == "transcribing":
-        for idx in range(state.current_page_index, state.pages_total):
-            ps = state.pages[idx]
-            state.current_page_index = idx
-            save_state(state, state_path)
-
-            if ps.status == "done":
-                continue
-            if ps.status == "failed":
-                continue
-            if ps.status == "needs_review" and not hitl:
-                continue
 
+        async def transcribe_one(ps: PageState) -> bool:
+            """
+            Egy oldal: stub vagy modell hívás, artifact mentés, policy döntés.
+            True, ha van transcript (False = failed).
+            """
             image_path = Path(ps.image_path)
             page_id = f"{source_id}_p{ps.page:03d}"
-
-            # HITL: previously flagged
-            if ps.status == "needs_review" and hitl:
-                ok = prompt_yes_no(f"Page {ps.page} flagged for review. Continue (accept as-is) and proceed?")
-                if not ok:
-                    log("Stopped for manual intervention.")
-                    return
-                ps.status = "pending"
-                save_state(state, state_path)
+            fingerprint = image_fingerprint(image_path)
 
             # Decide how to get a transcript for this page
             transcription: str
@@ -545,103 +838,219 @@ def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bo
             if not use_api:
                 # no-api mode -> stub only
                 if stub_mode == "replay":
-                    loaded = load_stub_diplomatic(stubs_root, page_id)
+                    loaded = load_stub_diplomatic(stubs_root, page_id, fingerprint)
                     if loaded is None:
                         transcription, meta = make_generated_stub(source_id, ps.page, page_id)
-                        save_stub_diplomatic(stubs_root, page_id, transcription, meta)
+                        save_stub_diplomatic(stubs_root, page_id, transcription, meta, fingerprint)
                         log(f"Stub missing, generated+saved: {page_id}")
                     else:
                         transcription, meta = loaded
                         log(f"Stub replay: {page_id}")
                 else:
                     transcription, meta = make_generated_stub(source_id, ps.page, page_id)
-                    save_stub_diplomatic(stubs_root, page_id, transcription, meta)
+                    save_stub_diplomatic(stubs_root, page_id, transcription, meta, fingerprint)
                     log(f"Stub generated+saved: {page_id}")
-            
+
             else:
                 # API mode -> real call
                 if stub_mode == "replay":
-                    loaded = load_stub_diplomatic(stubs_root, page_id)
+                    loaded = load_stub_diplomatic(stubs_root, page_id, fingerprint)
                     if loaded is None:
                         raise RuntimeError(f"Stub replay requested but missing stub for {page_id}")
                     transcription, meta = loaded
                     log(f"Stub replay (API suppressed): {page_id}")
                 else:
-                    log(f"Calling model for page {ps.page} (page_id={page_id})...")
-                    try:
-                        transcription, meta = call_with_process_timeout(
-                            180,
-                            transcribe_page_openai,
-                            diplomatic_prompt, image_path, source_id, lang, ps.page, page_id
-                        )
-                        log(f"Transcribed: page {ps.page} (model call)")
-                        if stub_mode == "record":
-                            save_stub_diplomatic(stubs_root, page_id, transcription, meta)
-                            log(f"Stub recorded: {page_id}")
-                    except Exception as e:
-                        ps.status = "failed"
-                        ps.notes = f"Model call failed: {type(e).__name__}: {e}"
-                        save_state(state, state_path)
-                        log(f"FAILED page {ps.page}: {type(e).__name__}: {e}")
-                        continue
+                    # content-addressed cache: azonos pixelekre nem hívunk modellt újra.
+                    # Retry-nál (retries_used > 0) megkerüljük, különben a cache
+                    # ugyanazt a rossz átiratot adná vissza és a retry no-op lenne;
+                    # a hívás utáni mentés felülírja a hash alatti bejegyzést.
+                    cached_txt, cached_meta = stub_paths(stubs_root, "diplomatic", page_id, fingerprint)
+                    if ps.retries_used == 0 and cached_txt.exists() and cached_meta.exists():
+                        transcription = cached_txt.read_text(encoding="utf-8")
+                        meta = json.loads(cached_meta.read_text(encoding="utf-8"))
+                        log(f"Cache hit (fp={fingerprint}): {page_id}, model call skipped")
+                    else:
+                        log(f"Calling model for page {ps.page} (page_id={page_id})...")
+                        try:
+                            transcription, meta = await asyncio.wait_for(
+                                transcribe_page_openai(
+                                    diplomatic_prompt, image_path, source_id, lang, ps.page, page_id
+                                ),
+                                timeout=180,
+                            )
+                            log(f"Transcribed: page {ps.page} (model call)")
+                            save_stub_diplomatic(stubs_root, page_id, transcription, meta, fingerprint)
+                            if stub_mode == "record":
+                                log(f"Stub recorded: {page_id}")
+                        except Exception as e:
+                            ps.status = "failed"
+                            ps.notes = f"Model call failed: {type(e).__name__}: {e}"
+                            log(f"FAILED page {ps.page}: {type(e).__name__}: {e}")
+                            return False
+
             # Persist page artifacts
             uncertain, illegible = count_markers(transcription)
             ps.uncertain_count = uncertain
             ps.illegible_count = illegible
+            ps.char_count = len(transcription)
             ps.confidence = meta.get("confidence")
 
-            txt_path = diplomatic_dir / f"{page_id}.txt"
-            meta_path = diplomatic_dir / f"{page_id}.meta.json"
-            txt_path.write_text(transcription, encoding="utf-8")
-            meta_path.write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding="utf-8")
-            ps.diplomatic_txt_path = str(txt_path)
-            ps.meta_path = str(meta_path)
+            # egyetlen append-only manifest 2xN kis fájl helyett;
+            # ismételt oldalnál (retry) az utolsó rekord nyer olvasáskor
+            with manifest_path.open("ab") as f:
+                f.write(json_dumps_line({"page": ps.page, "text": transcription, "meta": meta}) + b"\n")
+            ps.diplomatic_txt_path = f"{manifest_path}#{ps.page}"
+            ps.meta_path = f"{manifest_path}#{ps.page}"
 
             # Agent decision loop: retry? (only meaningful in API mode)
             if use_api and should_retry(uncertain, illegible, ps.retries_used, th):
                 ps.retries_used += 1
                 ps.notes = f"Retry budget used ({ps.retries_used}/{th['retry_budget']})."
-                save_state(state, state_path)
                 log(f"Retry triggered for page {ps.page} (u={uncertain}, i={illegible}). Re-run by restarting agent.")
                 # egyszerű minimalizmus: most csak flageljük; kifinomultabb verzióban automatikusan újrahívhatjuk
-                ps.status = "needs_review" if hitl else "pending"
-                save_state(state, state_path)
                 if hitl:
-                    log("Stopping for HITL after retry trigger.")
-                    return
+                    ps.status = "needs_review"
+                    return True
+                # nem-HITL: essünk át a review-checken, hogy a flag ne vesszen el
+                ps.status = "pending"
 
             # Needs human review?
             if needs_human_review(ps.confidence, uncertain, illegible, th):
                 ps.status = "needs_review"
                 ps.notes = f"Flagged (conf={ps.confidence}, u={uncertain}, i={illegible})"
-                save_state(state, state_path)
                 log(f"Flagged page {ps.page} for review.")
-                if hitl:
+            else:
+                ps.status = "done"
+                ps.notes = "Accepted"
+            return True
+
+        async def run_hitl_sequential() -> bool:
+            """HITL mód: soros feldolgozás, input() promptokkal. True = stop kérés."""
+            for idx in range(state.current_page_index, state.pages_total):
+                ps = state.pages[idx]
+                if state.current_page_index != idx:
+                    state.current_page_index = idx
+                    state._dirty = True
+
+                if ps.status == "done":
+                    continue
+                if ps.status == "failed":
+                    continue
+
+                # HITL: previously flagged
+                if ps.status == "needs_review":
+                    ok = prompt_yes_no(f"Page {ps.page} flagged for review. Continue (accept as-is) and proceed?")
+                    if not ok:
+                        log("Stopped for manual intervention.")
+                        maybe_flush(state, state_path)
+                        return True
+                    ps.status = "pending"
+                    state._dirty = True
+
+                # nem-HITL init csak felsorolja az oldalakat (lazy render);
+                # ha ilyen state-et HITL módban folytatunk, itt pótoljuk a képet
+                if not Path(ps.image_path).exists():
+                    log(f"Rendering missing image for page {ps.page}...")
+                    render_gen = render_pages_pdfium_async if rasterizer == "pdfium" else render_pages_async
+                    async for _ in render_gen(pdf_path, images_dir, source_id, state.dpi, [ps.page], image_format):
+                        pass
+
+                retries_before = ps.retries_used
+                got_transcript = await transcribe_one(ps)
+                state._dirty = True
+                if not got_transcript:
+                    maybe_flush(state, state_path)
+                    continue
+
+                if ps.retries_used > retries_before:
+                    log("Stopping for HITL after retry trigger.")
+                    maybe_flush(state, state_path)
+                    return True
+
+                if ps.status == "needs_review":
                     ok = prompt_yes_no("Stop now for human review? (y=stop, n=continue)")
                     if ok:
                         log("Stopped for human review.")
-                        return
+                        maybe_flush(state, state_path)
+                        return True
                     # ha nem áll meg, akkor elfogadjuk és megyünk tovább
                     ps.status = "done"
                     ps.notes = "Accepted after user chose to continue"
-                    save_state(state, state_path)
                     log(f"Continuing; page {ps.page} accepted.")
-                else:
-                    # HITL off: hagyjuk flagged-ként vagy accepteljük? itt flagged marad
-                    pass
-            else:
-                ps.status = "done"
-                ps.notes = "Accepted"
-                save_state(state, state_path)
+
+                # oldalhatár: egy flush / oldal
+                maybe_flush(state, state_path)
+            return False
+
+        async def run_concurrent() -> bool:
+            """
+            Producer/consumer pipeline: a producer a kész (vagy épp most
+            renderelt) oldalakat tolja egy asyncio.Queue-ba, `concurrency`
+            darab worker fogyasztja és hívja a modellt. Renderelés és
+            hálózati I/O átfedésben fut.
+            """
+            pending = {ps.page: ps for ps in state.pages if ps.status == "pending"}
+            queue: asyncio.Queue = asyncio.Queue()
+
+            async def producer() -> None:
+                try:
+                    missing: List[int] = []
+                    for ps in pending.values():
+                        if Path(ps.image_path).exists():
+                            await queue.put(ps)
+                        else:
+                            missing.append(ps.page)
+                    if missing:
+                        render_gen = render_pages_pdfium_async if rasterizer == "pdfium" else render_pages_async
+                        async for page_num in render_gen(
+                            pdf_path, images_dir, source_id, state.dpi, missing, image_format
+                        ):
+                            ps = pending.get(page_num)
+                            if ps is not None:
+                                await queue.put(ps)
+                finally:
+                    # workerenként egy záró jel — hibánál is, hogy ne lógjanak
+                    for _ in range(concurrency):
+                        await queue.put(None)
+
+            async def worker() -> None:
+                while True:
+                    ps = await queue.get()
+                    if ps is None:
+                        return
+                    await transcribe_one(ps)
+                    # completion callback: oldalanként egy flush (resume marad)
+                    state._dirty = True
+                    maybe_flush(state, state_path)
+
+            results = await asyncio.gather(
+                producer(), *[worker() for _ in range(concurrency)], return_exceptions=True
+            )
+            for r in results:
+                if isinstance(r, BaseException):
+                    raise r
+            state.current_page_index = state.pages_total
+            return False
+
+        # HITL módban soros marad (blokkoló promptok), egyébként concurrent
+        stopped = await (run_hitl_sequential() if hitl else run_concurrent())
+        if stopped:
+            return
+
+        if auto_thresholds:
+            # dokumentum-szintű, sűrűség-alapú újraflagelés a fix küszöbök után
+            apply_auto_thresholds(state, log)
+            state._dirty = True
 
         state.stage = "v1_ready"
         save_state(state, state_path)
         log("Stage: v1_ready")
 
     # Assemble v1
+    v1_text: Optional[str] = None
     if state.stage == "v1_ready":
         v1_path = out_dir / f"{source_id}_diplomatic_v1.txt"
-        assemble_v1(state, v1_path)
+        v1_text = assemble_v1(state, v1_path, manifest_path)
         state.v1_path = str(v1_path)
         state.stage = "normalizing"
         save_state(state, state_path)
@@ -651,7 +1060,9 @@ def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bo
     if state.stage == "normalizing":
         if not state.v1_path:
             raise RuntimeError("Missing v1_path in state.")
-        v1_text = Path(state.v1_path).read_text(encoding="utf-8")
+        if v1_text is None:
+            # resume út: a v1 egy korábbi futásban készült
+            v1_text = Path(state.v1_path).read_text(encoding="utf-8")
 
         if not use_api:
             # stub/no-op normalization
@@ -659,13 +1070,13 @@ def run_agent_for_pdf(pdf_path: Path, project_root: Path, lang: str, use_api: bo
             editlog: List[Dict[str, Any]] = []
             meta = {"source_id": source_id, "model_id": "stub", "policy_version": "v2", "total_changes": 0, "total_flags": 0, "notes": "stub/no-api"}
         else:
-            corrected, editlog, meta = normalize_v2_openai(normalization_prompt, v1_text, source_id, lang)
+            corrected, editlog, meta = await normalize_v2_openai(normalization_prompt, v1_text, source_id, lang)
             log("Normalized v2 (model call)")
 
         v2_path = out_dir / f"{source_id}_corrected_v2.txt"
         editlog_path = out_dir / f"{source_id}_editlog_v2.json"
         v2_path.write_text(corrected, encoding="utf-8")
-        editlog_path.write_text(json.dumps(editlog, ensure_ascii=False, indent=2), encoding="utf-8")
+        editlog_path.write_bytes(json_dumps(editlog))
 
         state.v2_path = str(v2_path)
         state.editlog_path = str(editlog_path)
@@ -704,6 +1115,16 @@ def main() -> None:
     ap.add_argument("--no-hitl", action="store_true", help="Disable human-in-the-loop prompts")
     ap.add_argument("--stub-mode", choices=["off", "record", "replay", "generate"], default="off",
                     help="Stub behavior: off=none, record=save real outputs, replay=use stubs only, generate=always generate+save stubs")
+    ap.add_argument("--concurrency", type=int, default=int(os.environ.get("TRANSCRIBE_CONCURRENCY", 8)),
+                    help="Max concurrent page transcriptions per PDF (ignored in HITL mode)")
+    ap.add_argument("--doc-concurrency", type=int, default=4,
+                    help="Max PDFs processed concurrently in directory mode (forced to 1 in HITL mode)")
+    ap.add_argument("--rasterizer", choices=["pdftoppm", "pdfium"], default="pdftoppm",
+                    help="PDF -> PNG backend: pdftoppm (poppler binary) or pdfium (in-process pypdfium2)")
+    ap.add_argument("--image-format", choices=["png", "jpeg"], default="png",
+                    help="Page image format: jpeg (q90) is ~10x smaller per upload than 300dpi png")
+    ap.add_argument("--auto-thresholds", action="store_true",
+                    help="Re-flag pages by marker density (median + 3*MAD across the document) instead of fixed counts; needs numpy")
     args = ap.parse_args()
 
     project_root = Path(args.project_root).resolve()
@@ -713,8 +1134,19 @@ def main() -> None:
     hitl = not args.no_hitl
 
     pdfs = iter_pdfs(input_path)
-    for pdf in pdfs:
-        run_agent_for_pdf(pdf, project_root, args.lang, use_api, hitl, args.stub_mode)
+
+    # minden PDF egy event loop alatt fut; dokumentum-szintű semaphore
+    # korlátozza, hány PDF modell-hívásai futhatnak átfedésben
+    async def _main() -> None:
+        sem = asyncio.Semaphore(1 if hitl else args.doc_concurrency)
+
+        async def _run(pdf: Path) -> None:
+            async with sem:
+                await run_agent_for_pdf(pdf, project_root, args.lang, use_api, hitl, args.stub_mode, args.concurrency, args.rasterizer, args.image_format, args.auto_thresholds)
+
+        await asyncio.gather(*[_run(pdf) for pdf in pdfs])
+
+    asyncio.run(_main())
 
 
 if __name__ == "__main__":